@@ -9,6 +9,7 @@ except DistributionNotFound:
 __license__ = 'Apache 2.0'
 
 import diskcache
+import functools
 import getpass
 import glob
 import io
@@ -149,6 +150,37 @@ class GirderClient:
         else:
             return 'https'
 
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _resolveUrlParts(apiUrl, host, scheme, port, apiRoot):
+        """
+        Compute the base URL of the REST API and the host, scheme, and port it
+        was built from. If `apiUrl` is given the individual parts are ignored
+        and returned as None. The caller must already have substituted the
+        class defaults for a missing `host` and `apiRoot`, so that the result
+        only depends on the arguments and can be cached for clients that are
+        repeatedly created for the same server.
+
+        :returns: A tuple of ``(urlBase, host, scheme, port)``.
+        """
+        if apiUrl is not None:
+            urlBase = apiUrl
+            host = scheme = port = None
+        else:
+            # If needed, prepend '/'
+            if not apiRoot.startswith('/'):
+                apiRoot = '/' + apiRoot
+
+            scheme = scheme or GirderClient.getDefaultScheme(host)
+            port = port or GirderClient.getDefaultPort(host, scheme)
+
+            urlBase = '%s://%s:%s%s' % (scheme, host, str(port), apiRoot)
+
+        if urlBase[-1] != '/':
+            urlBase += '/'
+
+        return urlBase, host, scheme, port
+
     def __init__(self, host=None, port=None, apiRoot=None, scheme=None, apiUrl=None,
                  cacheSettings=None, progressReporterCls=None):
         """
@@ -179,27 +211,8 @@ class GirderClient:
             initialized using `sys.stdout.isatty()`).
             This defaults to :class:`_NoopProgressReporter`.
         """
-        self.host = None
-        self.scheme = None
-        self.port = None
-        if apiUrl is None:
-            if not apiRoot:
-                apiRoot = self.DEFAULT_API_ROOT
-            # If needed, prepend '/'
-            if not apiRoot.startswith('/'):
-                apiRoot = '/' + apiRoot
-
-            self.host = host or self.DEFAULT_HOST
-            self.scheme = scheme or GirderClient.getDefaultScheme(self.host)
-            self.port = port or GirderClient.getDefaultPort(self.host, self.scheme)
-
-            self.urlBase = '%s://%s:%s%s' % (
-                self.scheme, self.host, str(self.port), apiRoot)
-        else:
-            self.urlBase = apiUrl
-
-        if self.urlBase[-1] != '/':
-            self.urlBase += '/'
+        self.urlBase, self.host, self.scheme, self.port = self._resolveUrlParts(
+            apiUrl, host or self.DEFAULT_HOST, scheme, port, apiRoot or self.DEFAULT_API_ROOT)
 
         self.token = ''
         self._folderUploadCallbacks = []
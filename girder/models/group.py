@@ -122,22 +122,41 @@ class Group(AccessControlledModel):
         the group. If the user already belongs to the group, this method can
         be used to change their access level within it.
         """
+        self.addUserToGroups(user, [(group, level)])
+
+        return group
+
+    def addUserToGroups(self, user, memberships):
+        """
+        Add the user to several groups at once. This behaves like calling
+        addUser for each group, except that the user document is saved only
+        once for all of the new memberships. Each group document is still
+        saved separately.
+
+        :param user: The user to add.
+        :type user: dict
+        :param memberships: The groups to add the user to.
+        :type memberships: list of (group, level) tuples
+        """
         from .user import User
 
         if 'groups' not in user:
             user['groups'] = []
 
-        if not group['_id'] in user['groups']:
-            user['groups'].append(group['_id'])
+        added = False
+        for group, _ in memberships:
+            if group['_id'] not in user['groups']:
+                user['groups'].append(group['_id'])
+                added = True
+        if added:
             # saved again in setUserAccess...
             user = User().save(user, validate=False)
 
-        # Delete outstanding request if one exists
-        self._deleteRequest(group, user)
+        for group, level in memberships:
+            # Delete outstanding request if one exists
+            self._deleteRequest(group, user)
 
-        self.setUserAccess(group, user, level, save=True)
-
-        return group
+            self.setUserAccess(group, user, level, save=True)
 
     def _deleteRequest(self, group, user):
         """
@@ -1,3 +1,22 @@
+import time
+
+from bson.objectid import ObjectId
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+else:
+    # Other packages are also installed as ``re2``; only google-re2 provides
+    # the set API used here.
+    if not hasattr(re2, 'Set'):
+        re2 = None
+
 from girder import events
 from girder.models.group import Group
 from girder.models.setting import Setting
@@ -5,21 +24,158 @@ from girder.plugin import GirderPlugin
 
 from .settings import PluginSettings
 
+# How long (in seconds) the autojoin rules are reused before being re-read
+# from the settings collection.
+_RULES_TTL = 60
+_RULES_CACHE = {'value': None, 'expires': 0}
+
+
+def _normalizeRules(rules):
+    """
+    Convert the autojoin setting value into a tuple of
+    ``(case-folded pattern, group id, access level)`` tuples.
+    """
+    return tuple(
+        (rule['pattern'].casefold(), rule['groupId'], rule['level']) for rule in rules)
+
+
+class _CompiledRules:
+    """
+    The autojoin rules in a form that is cheap to match against an email
+    address. If the optional ``pyahocorasick`` package is installed, all of the
+    patterns are matched in a single pass over the address with an
+    Aho-Corasick automaton. Otherwise, if the optional ``google-re2`` package is
+    installed, the patterns are compiled into an RE2 set, which reports every
+    matching pattern from a single pass over the address. As a last resort
+    each pattern is searched for in turn.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+
+        # Several rules may share a pattern, so each distinct pattern is only
+        # searched for once and maps to the indices of all of its rules.
+        ruleIndices = {}
+        for idx, (pattern, _, _) in enumerate(self.rules):
+            ruleIndices.setdefault(pattern, []).append(idx)
+        self._patterns = tuple(
+            (pattern, tuple(indices)) for pattern, indices in ruleIndices.items())
+
+        # An empty pattern matches every address but cannot be added to the
+        # automaton or the regular expression set.
+        self._automaton = None
+        self._regexSet = None
+        self._alwaysMatched = tuple(ruleIndices.get('', ()))
+        patterns = [pattern for pattern in ruleIndices if pattern]
+        if not patterns:
+            return
+
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for pattern in patterns:
+                self._automaton.add_word(pattern, tuple(ruleIndices[pattern]))
+            self._automaton.make_automaton()
+        elif re2 is not None:
+            # Unlike an alternation, a set reports overlapping matches too, so
+            # each pattern's position in the set maps directly to its rules.
+            self._regexSet = re2.Set.SearchSet()
+            for pattern in patterns:
+                self._regexSet.Add(re2.escape(pattern))
+            self._regexSet.Compile()
+            self._setIndices = tuple(tuple(ruleIndices[pattern]) for pattern in patterns)
+
+    def match(self, email):
+        """
+        Return the rules whose pattern is contained in a case-folded email
+        address, in the order that the rules are defined.
+
+        :param email: The case-folded email address.
+        :type email: str
+        :returns: A list of ``(pattern, groupId, level)`` tuples.
+        """
+        if self._automaton is not None:
+            matched = set(self._alwaysMatched)
+            for _, indices in self._automaton.iter(email):
+                matched.update(indices)
+        elif self._regexSet is not None:
+            matched = set(self._alwaysMatched)
+            for setIdx in self._regexSet.Match(email) or ():
+                matched.update(self._setIndices[setIdx])
+        else:
+            matched = {
+                idx for pattern, indices in self._patterns if pattern in email
+                for idx in indices}
+        return [self.rules[idx] for idx in sorted(matched)]
+
+
+def _loadGroups(groupIds):
+    """
+    Fetch the groups with the given ids with a single query.
+
+    :param groupIds: The group id strings.
+    :returns: A dictionary mapping group id strings to group documents. Ids
+        that are invalid or do not refer to an existing group are omitted.
+    """
+    objectIds = [ObjectId(groupId) for groupId in set(groupIds) if ObjectId.is_valid(groupId)]
+    if not objectIds:
+        return {}
+    return {
+        str(group['_id']): group
+        for group in Group().find({'_id': {'$in': objectIds}})
+    }
+
+
+def _getRules():
+    """
+    Return the compiled autojoin rules, reading them from the settings
+    collection only if the cached copy is missing or has expired.
+
+    :rtype: _CompiledRules
+    """
+    if _RULES_CACHE['value'] is None or time.monotonic() >= _RULES_CACHE['expires']:
+        rules = _normalizeRules(Setting().get(PluginSettings.AUTOJOIN))
+        # Only rebuild the matcher if the rules actually changed.
+        if _RULES_CACHE['value'] is None or _RULES_CACHE['value'].rules != rules:
+            _RULES_CACHE['value'] = _CompiledRules(rules)
+        _RULES_CACHE['expires'] = time.monotonic() + _RULES_TTL
+    return _RULES_CACHE['value']
+
+
+def _invalidateRules():
+    # The compiled rules are kept so that they can be reused if the setting
+    # turns out to be unchanged.
+    _RULES_CACHE['expires'] = 0
+
+
+def _settingChanged(event):
+    if event.info.get('key') == PluginSettings.AUTOJOIN:
+        _invalidateRules()
+
 
 def userCreated(event):
     """
     Check auto join rules when a new user is created. If a match is found,
     add the user to the group with the specified access level.
     """
+    rules = _getRules()
+    if not rules.rules:
+        return
+
     user = event.info
-    email = user.get('email').lower()
-    rules = Setting().get(PluginSettings.AUTOJOIN)
-    for rule in rules:
-        if rule['pattern'].lower() not in email:
-            continue
-        group = Group().load(rule['groupId'], force=True)
-        if group:
-            Group().addUser(group, user, rule['level'])
+    email = user['email'].casefold()
+    matched = rules.match(email)
+    if not matched:
+        return
+
+    # Group documents are never cached, as saving a stale copy would overwrite
+    # newer changes to the group. Load the matched groups fresh instead.
+    groups = _loadGroups(groupId for _, groupId, _ in matched)
+    matches = [
+        (groups[groupId], level) for _, groupId, level in matched if groupId in groups]
+    if not matches:
+        return
+
+    Group().addUserToGroups(user, matches)
 
 
 class AutojoinPlugin(GirderPlugin):
@@ -28,3 +184,5 @@ class AutojoinPlugin(GirderPlugin):
 
     def load(self, info):
         events.bind('model.user.save.created', 'autojoin', userCreated)
+        events.bind('model.setting.save.after', 'autojoin', _settingChanged)
+        events.bind('model.setting.remove', 'autojoin', _settingChanged)
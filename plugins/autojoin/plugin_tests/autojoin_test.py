@@ -1,8 +1,14 @@
 from girder.constants import AccessType
 from girder.models.group import Group
+from girder.models.setting import Setting
 from girder.models.user import User
+from girder_autojoin import _CompiledRules, _invalidateRules, _normalizeRules
+from girder_autojoin.settings import PluginSettings
 from tests import base
+import girder_autojoin
 import json
+import unittest
+import unittest.mock
 
 
 def setUpModule():
@@ -18,6 +24,9 @@ class AutoJoinTest(base.TestCase):
 
     def setUp(self):
         super().setUp()
+        # The database is dropped between tests without triggering any events,
+        # so expire the rules cached by a previous test.
+        _invalidateRules()
 
         self.users = [User().createUser(
             'usr%s' % num, 'passwd', 'tst', 'usr', 'u%s@girder4.test' % num)
@@ -74,3 +83,109 @@ class AutoJoinTest(base.TestCase):
         self.assertIn(
             {'id': user1['_id'], 'level': AccessType.WRITE, 'flags': []},
             g3['access']['users'])
+
+    def testRulesChangeTakesEffect(self):
+        admin, user = self.users
+        group = Group().createGroup('g1', admin)
+
+        # Create a user so that the (empty) rules are cached
+        user1 = User().createUser('user1', 'password', 'John', 'Doe', 'user1@girder1.test')
+        self.assertEqual(user1['groups'], [])
+
+        # Changing the setting must invalidate the cached rules
+        Setting().set(PluginSettings.AUTOJOIN, [{
+            'pattern': '@girder1.test',
+            'groupId': str(group['_id']),
+            'level': AccessType.READ
+        }])
+        user2 = User().createUser('user2', 'password', 'John', 'Doe', 'user2@girder1.test')
+        self.assertEqual(user2['groups'], [group['_id']])
+
+        Setting().unset(PluginSettings.AUTOJOIN)
+        user3 = User().createUser('user3', 'password', 'John', 'Doe', 'user3@girder1.test')
+        self.assertEqual(user3['groups'], [])
+
+    def testGroupChangesAreNotReverted(self):
+        admin, user = self.users
+        g1 = Group().createGroup('g1', admin)
+        g2 = Group().createGroup('g2', admin)
+        Setting().set(PluginSettings.AUTOJOIN, [
+            {'pattern': '@girder1.test', 'groupId': str(g1['_id']), 'level': AccessType.READ},
+            {'pattern': '@girder1.test', 'groupId': str(g2['_id']), 'level': AccessType.READ},
+        ])
+        user1 = User().createUser('user1', 'password', 'John', 'Doe', 'user1@girder1.test')
+        self.assertEqual(user1['groups'], [g1['_id'], g2['_id']])
+
+        # Changes made to the groups after the rules were cached must survive
+        # later autojoins, and removed groups must not be joined.
+        g1 = Group().load(g1['_id'], force=True)
+        g1['name'] = 'renamed'
+        Group().save(g1)
+        Group().update({'_id': g1['_id']}, {'$set': {'description': 'changed'}})
+        Group().remove(Group().load(g2['_id'], force=True))
+
+        user2 = User().createUser('user2', 'password', 'John', 'Doe', 'user2@girder1.test')
+        self.assertEqual(user2['groups'], [g1['_id']])
+        g1 = Group().load(g1['_id'], force=True)
+        self.assertEqual(g1['name'], 'renamed')
+        self.assertEqual(g1['description'], 'changed')
+
+
+class CompiledRulesTest(unittest.TestCase):
+    rules = [
+        {'pattern': '@girder.test', 'groupId': 'a', 'level': AccessType.READ},
+        # Overlaps the first pattern
+        {'pattern': 'girder', 'groupId': 'b', 'level': AccessType.READ},
+        # A prefix of the first pattern, in a different case
+        {'pattern': '@GIRDER', 'groupId': 'c', 'level': AccessType.READ},
+        # The same pattern as another rule
+        {'pattern': '@girder.test', 'groupId': 'd', 'level': AccessType.WRITE},
+        # Matches every address
+        {'pattern': '', 'groupId': 'e', 'level': AccessType.READ},
+        {'pattern': 'other.test', 'groupId': 'f', 'level': AccessType.READ},
+        # Overlaps the end of a local part and the start of the domain
+        {'pattern': 'r@g', 'groupId': 'g', 'level': AccessType.READ},
+    ]
+
+    def _match(self, rules, email):
+        compiled = _CompiledRules(_normalizeRules(rules))
+        return [groupId for _, groupId, _ in compiled.match(email.casefold())]
+
+    def _checkMatches(self):
+        self.assertEqual(
+            self._match(self.rules, 'user@girder.test'), ['a', 'b', 'c', 'd', 'e', 'g'])
+        self.assertEqual(self._match(self.rules, 'User@Other.Test'), ['e', 'f'])
+        self.assertEqual(
+            self._match(self.rules, 'girder@girder.other.test'), ['b', 'c', 'e', 'f', 'g'])
+        self.assertEqual(self._match(self.rules, 'nobody@example.test'), ['e'])
+        self.assertEqual(self._match(self.rules[:1], 'nobody@example.test'), [])
+        self.assertEqual(self._match(self.rules[4:5], 'nobody@example.test'), ['e'])
+        self.assertEqual(self._match([], 'nobody@example.test'), [])
+
+        # Every backend must agree with a plain substring search
+        for email in ('user@girder.test', 'r@girder.test', 'girder', '@girder.tes',
+                      'user@sub.other.test', '', 'r@g'):
+            self.assertEqual(self._match(self.rules, email), [
+                rule['groupId'] for rule in self.rules
+                if rule['pattern'].casefold() in email])
+
+    @unittest.skipIf(girder_autojoin.ahocorasick is None, 'pyahocorasick is not installed')
+    def testAhoCorasick(self):
+        self.assertIsNotNone(_CompiledRules(_normalizeRules(self.rules))._automaton)
+        self._checkMatches()
+
+    @unittest.skipIf(girder_autojoin.re2 is None, 'google-re2 is not installed')
+    def testRe2Set(self):
+        with unittest.mock.patch.object(girder_autojoin, 'ahocorasick', None):
+            compiled = _CompiledRules(_normalizeRules(self.rules))
+            self.assertIsNone(compiled._automaton)
+            self.assertIsNotNone(compiled._regexSet)
+            self._checkMatches()
+
+    def testSubstringSearch(self):
+        with unittest.mock.patch.object(girder_autojoin, 'ahocorasick', None), \
+                unittest.mock.patch.object(girder_autojoin, 're2', None):
+            compiled = _CompiledRules(_normalizeRules(self.rules))
+            self.assertIsNone(compiled._automaton)
+            self.assertIsNone(compiled._regexSet)
+            self._checkMatches()
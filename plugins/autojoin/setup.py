@@ -44,6 +44,10 @@ setup(
     packages=find_packages(exclude=['plugin_tests']),
     zip_safe=False,
     install_requires=['girder>=3'],
+    extras_require={
+        'ahocorasick': ['pyahocorasick'],
+        're2': ['google-re2>=1.0']
+    },
     entry_points={
         'girder.plugin': [
             'autojoin = girder_autojoin:AutojoinPlugin'
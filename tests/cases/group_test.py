@@ -60,6 +60,34 @@ class GroupTestCase(base.TestCase):
         user2 = User().load(self.users[2]['_id'], force=True)
         self.assertFalse(group['_id'] in user2.get('groups', ()))
 
+    def testAddUserToGroups(self):
+        group1 = Group().createGroup('g1', self.users[0])
+        group2 = Group().createGroup('g2', self.users[0])
+
+        # User 1 has an outstanding request to join group 2
+        Group().joinGroup(group2, self.users[1])
+        group2 = Group().load(group2['_id'], force=True)
+        self.assertIn(self.users[1]['_id'], group2['requests'])
+
+        Group().addUserToGroups(self.users[1], [
+            (group1, AccessType.READ), (group2, AccessType.WRITE)])
+        user1 = User().load(self.users[1]['_id'], force=True)
+        self.assertEqual(user1['groups'], [group1['_id'], group2['_id']])
+
+        group1 = Group().load(group1['_id'], force=True)
+        group2 = Group().load(group2['_id'], force=True)
+        self.assertTrue(Group().hasAccess(group1, user1, AccessType.READ))
+        self.assertFalse(Group().hasAccess(group1, user1, AccessType.WRITE))
+        self.assertTrue(Group().hasAccess(group2, user1, AccessType.WRITE))
+        self.assertNotIn(user1['_id'], group2['requests'])
+
+        # Adding the user again only changes the access level
+        Group().addUserToGroups(user1, [(group1, AccessType.ADMIN)])
+        user1 = User().load(user1['_id'], force=True)
+        group1 = Group().load(group1['_id'], force=True)
+        self.assertEqual(user1['groups'], [group1['_id'], group2['_id']])
+        self.assertTrue(Group().hasAccess(group1, user1, AccessType.ADMIN))
+
     def testDeleteGroupDeletesAccessReferences(self):
         """
         This test ensures that when a group is deleted, references to it in
@@ -1,14 +1,14 @@
 import contextlib
 import girder_client.cli
 from http.client import HTTPConnection
-import io
 import logging
 import os
 import requests
-import shutil
 import sys
+import tempfile
 import urllib.parse
 import httmock
+import unittest
 import unittest.mock
 
 from girder import config
@@ -22,18 +22,111 @@ from tests import base
 os.environ['GIRDER_PORT'] = os.environ.get('GIRDER_TEST_PORT', '20200')
 config.loadConfig()  # Must reload config to pickup correct port
 
+_ARGV_PREFIX_PORT = ('girder-client', '--port', os.environ['GIRDER_PORT'])
+_ARGV_PREFIX_URL = (
+    'girder-client', '--api-url', 'http://localhost:%s/api/v1' % os.environ['GIRDER_PORT'])
+
+_GC_LOGGER = logging.getLogger('girder_client')
+# Every CLI invocation adds a stderr handler to each of these loggers.
+_CLI_LOGGERS = (_GC_LOGGER, logging.getLogger('requests.packages.urllib3'))
+
+# The in-process test server logs to the stdout file descriptor when requested
+# (see tests/base.py), which must not end up in the captured CLI output.
+_SERVER_LOGS_TO_STDOUT = 'cherrypy' in os.environ.get('EXTRADEBUG', '').split()
+
+
+class CapturedOutput:
+    """
+    The text written to stdout (``out``) and stderr (``err``) within a
+    captureOutput context. Both are None until the context has exited.
+    """
+
+    __slots__ = ('out', 'err')
+
+    def __init__(self):
+        self.out = None
+        self.err = None
+
 
 @contextlib.contextmanager
 def captureOutput():
+    """
+    Capture everything written to the stdout and stderr file descriptors while
+    the context is active, including output that bypasses the ``sys.stdout``
+    and ``sys.stderr`` objects. The captured text is only read back once, on
+    exit.
+
+    File descriptor capture also collects output from other threads, such as
+    the in-process test server. When the server is logging to stdout
+    (``EXTRADEBUG=cherrypy``), only the ``sys.stdout`` and ``sys.stderr``
+    objects are replaced instead.
+    """
     oldout, olderr = sys.stdout, sys.stderr
+    oldout.flush()
+    olderr.flush()
+    output = CapturedOutput()
+    # A pipe drained only on exit would block once its buffer fills up, so
+    # the output is spooled to temporary files instead.
+    with tempfile.TemporaryFile() as outFile, tempfile.TemporaryFile() as errFile:
+        savedFds = []
+        streams = []
+        try:
+            for fd, file in ((1, outFile), (2, errFile)):
+                if _SERVER_LOGS_TO_STDOUT:
+                    fd = file.fileno()
+                else:
+                    savedFds.append((fd, os.dup(fd)))
+                    os.dup2(file.fileno(), fd)
+                streams.append(open(fd, 'w', encoding='utf8', closefd=False))
+            sys.stdout, sys.stderr = streams
+            yield output
+        finally:
+            # Only close the streams opened here, never the original ones.
+            for stream in streams:
+                stream.close()
+            sys.stdout, sys.stderr = oldout, olderr
+            for fd, savedFd in savedFds:
+                os.dup2(savedFd, fd)
+                os.close(savedFd)
+        output.out, output.err = [
+            _readCapture(file) for file in (outFile, errFile)]
+
+
+def _readCapture(file):
+    file.seek(0)
+    return file.read().decode('utf8')
+
+
+def _fastClear(path):
+    """
+    Remove a directory and everything in it, if it exists. Unlike
+    shutil.rmtree, this relies on the file types cached by os.scandir rather
+    than stat-ing every entry.
+    """
+    try:
+        entries = os.scandir(path)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                _fastClear(entry.path)
+            else:
+                os.unlink(entry.path)
+    os.rmdir(path)
+
+
+@contextlib.contextmanager
+def _restoreHandlers(loggers):
+    """
+    Restore the handlers of the given loggers on exit.
+    """
+    handlers = [(logger, logger.handlers[:]) for logger in loggers]
     try:
-        out = [io.StringIO(), io.StringIO()]
-        sys.stdout, sys.stderr = out
-        yield out
+        yield
     finally:
-        sys.stdout, sys.stderr = oldout, olderr
-        out[0] = out[0].getvalue()
-        out[1] = out[1].getvalue()
+        for logger, loggerHandlers in handlers:
+            logger.handlers = loggerHandlers
 
 
 class SysExitException(Exception):
@@ -44,11 +137,7 @@ def invokeCli(argv, username='', password='', useApiUrl=False):
     """
     Invoke the Girder Python client CLI with a set of arguments.
     """
-    if useApiUrl:
-        apiUrl = 'http://localhost:%s/api/v1' % os.environ['GIRDER_PORT']
-        argsList = ['girder-client', '--api-url', apiUrl]
-    else:
-        argsList = ['girder-client', '--port', os.environ['GIRDER_PORT']]
+    argsList = list(_ARGV_PREFIX_URL if useApiUrl else _ARGV_PREFIX_PORT)
 
     if username:
         argsList += ['--username', username]
@@ -58,7 +147,10 @@ def invokeCli(argv, username='', password='', useApiUrl=False):
     argsList += list(argv)
 
     exitVal = 0
-    with unittest.mock.patch.object(sys, 'argv', argsList), \
+    # The handlers added by the CLI write to the capture streams, which are
+    # closed on exit, so they must not outlive the invocation.
+    with _restoreHandlers(_CLI_LOGGERS), \
+            unittest.mock.patch.object(sys, 'argv', argsList), \
             unittest.mock.patch('sys.exit', side_effect=SysExitException) as exit, \
             captureOutput() as output:
         try:
@@ -68,45 +160,16 @@ def invokeCli(argv, username='', password='', useApiUrl=False):
             exitVal = args[0] if len(args) else 0
     return {
         'exitVal': exitVal,
-        'stdout': output[0],
-        'stderr': output[1]
+        'stdout': output.out,
+        'stderr': output.err
     }
 
 
-def setUpModule():
-    plugins = os.environ.get('ENABLED_PLUGINS', '')
-    if plugins:
-        base.enabledPlugins.extend(plugins.split())
-    base.startServer(False)
-
-
-def tearDownModule():
-    base.stopServer()
-
-
-class PythonCliTestCase(base.TestCase):
-
-    def setUp(self):
-        super().setUp()
-
-        self.user = User().createUser(
-            firstName='First', lastName='Last', login='mylogin',
-            password='password', email='email@girder.test')
-        self.publicFolder = next(Folder().childFolders(
-            parentType='user', parent=self.user, user=None, limit=1))
-        self.apiKey = ApiKey().createApiKey(self.user, name='')
-
-        self.downloadDir = os.path.join(
-            os.path.dirname(__file__), '_testDownload')
-        shutil.rmtree(self.downloadDir, ignore_errors=True)
-
-    def tearDown(self):
-        logger = logging.getLogger('girder_client')
-        logger.setLevel(logging.ERROR)
-        logger.handlers = []
-        shutil.rmtree(self.downloadDir, ignore_errors=True)
-
-        base.TestCase.tearDown(self)
+class CliOfflineTestCase(unittest.TestCase):
+    """
+    Tests that only exercise argument parsing and client construction, so they
+    need neither a running server nor a database.
+    """
 
     def testUrlByPart(self):
         # This test does NOT connect to the test server. It only checks that the
@@ -199,6 +262,44 @@ class PythonCliTestCase(base.TestCase):
         self.assertIn('Usage: ', ret['stdout'])
         self.assertEqual(ret['exitVal'], 0)
 
+
+class CliServerTestCase(base.TestCase):
+    # The server is started for this class rather than the whole module, so
+    # that running only CliOfflineTestCase does not need it.
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        plugins = os.environ.get('ENABLED_PLUGINS', '')
+        if plugins:
+            base.enabledPlugins.extend(plugins.split())
+        base.startServer(False)
+
+    @classmethod
+    def tearDownClass(cls):
+        base.stopServer()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User().createUser(
+            firstName='First', lastName='Last', login='mylogin',
+            password='password', email='email@girder.test')
+        self.publicFolder = next(Folder().childFolders(
+            parentType='user', parent=self.user, user=None, limit=1))
+        self.apiKey = ApiKey().createApiKey(self.user, name='')
+
+        self.downloadDir = os.path.join(
+            os.path.dirname(__file__), '_testDownload')
+        _fastClear(self.downloadDir)
+
+    def tearDown(self):
+        _GC_LOGGER.setLevel(logging.ERROR)
+        _GC_LOGGER.handlers = []
+        _fastClear(self.downloadDir)
+
+        base.TestCase.tearDown(self)
+
     def testUploadDownload(self):
         localDir = os.path.join(os.path.dirname(__file__), 'testdata')
         args = ['upload', str(self.publicFolder['_id']), localDir, '--parent-type=folder']
@@ -237,7 +338,7 @@ class PythonCliTestCase(base.TestCase):
 
         items = list(Folder().childItems(folder=subfolder))
 
-        toUpload = list(os.listdir(localDir))
+        toUpload = {entry.name for entry in os.scandir(localDir)}
         self.assertEqual(len(toUpload), len(items))
 
         downloadDir = os.path.join(os.path.dirname(localDir), '_testDownload')
@@ -273,10 +374,9 @@ class PythonCliTestCase(base.TestCase):
                 args + ['--reference', 'reference_string'], username='mylogin', password='password')
 
         # Test if reference is sent with each file upload
-        fileList = os.listdir(localDir)
         self.assertTrue(queryList)
-        self.assertTrue(fileList)
-        self.assertEqual(len(queryList), len(fileList))
+        self.assertTrue(toUpload)
+        self.assertEqual(len(queryList), len(toUpload))
         for query in queryList:
             self.assertIn('reference', query)
             self.assertIn('reference_string', query['reference'])
@@ -298,14 +398,14 @@ class PythonCliTestCase(base.TestCase):
                          downloadDir), username='mylogin', password='password')
         self.assertEqual(ret['exitVal'], 0)
         self.assertTrue(os.path.isdir(os.path.join(downloadDir, 'my_folder')))
-        shutil.rmtree(downloadDir, ignore_errors=True)
+        _fastClear(downloadDir)
 
         # Test download of the collection auto-detecting parent-type
         ret = invokeCli(('download', '/collection/my_collection',
                          downloadDir), username='mylogin', password='password')
         self.assertEqual(ret['exitVal'], 0)
         self.assertTrue(os.path.isdir(os.path.join(downloadDir, 'my_folder')))
-        shutil.rmtree(downloadDir, ignore_errors=True)
+        _fastClear(downloadDir)
 
         # Test download of a user
         ret = invokeCli(('download', '--parent-type=user', '/user/mylogin',
@@ -313,7 +413,7 @@ class PythonCliTestCase(base.TestCase):
         self.assertEqual(ret['exitVal'], 0)
         self.assertTrue(
             os.path.isfile(os.path.join(downloadDir, 'Public', 'testdata', 'hello.txt')))
-        shutil.rmtree(downloadDir, ignore_errors=True)
+        _fastClear(downloadDir)
 
         # Test download of a user auto-detecting parent-type
         ret = invokeCli(('download', '/user/mylogin',
@@ -321,7 +421,7 @@ class PythonCliTestCase(base.TestCase):
         self.assertEqual(ret['exitVal'], 0)
         self.assertTrue(
             os.path.isfile(os.path.join(downloadDir, 'Public', 'testdata', 'hello.txt')))
-        shutil.rmtree(downloadDir, ignore_errors=True)
+        _fastClear(downloadDir)
 
         # Test download of an item
         items = list(Folder().childItems(folder=subfolder))
@@ -332,7 +432,7 @@ class PythonCliTestCase(base.TestCase):
         self.assertEqual(ret['exitVal'], 0)
         self.assertTrue(
             os.path.isfile(os.path.join(downloadDir, item_name)))
-        shutil.rmtree(downloadDir, ignore_errors=True)
+        _fastClear(downloadDir)
 
         # Test download of a file
         os.makedirs(downloadDir)
@@ -346,7 +446,7 @@ class PythonCliTestCase(base.TestCase):
         self.assertEqual(ret['exitVal'], 0)
         self.assertTrue(
             os.path.isfile(os.path.join(downloadDir, file_name)))
-        shutil.rmtree(downloadDir, ignore_errors=True)
+        _fastClear(downloadDir)
 
         # Test download of an item auto-detecting parent-type
         ret = invokeCli(('download', '%s' % item_id,
@@ -354,7 +454,7 @@ class PythonCliTestCase(base.TestCase):
         self.assertEqual(ret['exitVal'], 0)
         self.assertTrue(
             os.path.isfile(os.path.join(downloadDir, item_name)))
-        shutil.rmtree(downloadDir, ignore_errors=True)
+        _fastClear(downloadDir)
 
         def _check_upload(ret):
             self.assertEqual(ret['exitVal'], 0)
@@ -421,25 +521,25 @@ class PythonCliTestCase(base.TestCase):
         args = ['localsync', '--help']
         ret = invokeCli(args, username='mylogin', password='password')
         self.assertEqual(ret['exitVal'], 0)
-        self.assertEqual(logging.getLogger('girder_client').level, logging.ERROR)
+        self.assertEqual(_GC_LOGGER.level, logging.ERROR)
 
     def testVerboseLoggingLevel1(self):
         args = ['-v', 'localsync', '--help']
         ret = invokeCli(args, username='mylogin', password='password')
         self.assertEqual(ret['exitVal'], 0)
-        self.assertEqual(logging.getLogger('girder_client').level, logging.WARNING)
+        self.assertEqual(_GC_LOGGER.level, logging.WARNING)
 
     def testVerboseLoggingLevel2(self):
         args = ['-vv', 'localsync', '--help']
         ret = invokeCli(args, username='mylogin', password='password')
         self.assertEqual(ret['exitVal'], 0)
-        self.assertEqual(logging.getLogger('girder_client').level, logging.INFO)
+        self.assertEqual(_GC_LOGGER.level, logging.INFO)
 
     def testVerboseLoggingLevel3(self):
         args = ['-vvv', 'localsync', '--help']
         ret = invokeCli(args, username='mylogin', password='password')
         self.assertEqual(ret['exitVal'], 0)
-        self.assertEqual(logging.getLogger('girder_client').level, logging.DEBUG)
+        self.assertEqual(_GC_LOGGER.level, logging.DEBUG)
         self.assertEqual(HTTPConnection.debuglevel, 1)
 
     def testRetryUpload(self):